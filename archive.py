@@ -0,0 +1,299 @@
+"""Cold storage for old detections.
+
+Detections older than a cutoff are moved out of the live `detections` table
+into one gzip-compressed, column-oriented JSON file per day
+(ARCHIVE_DIR/detections/YYYY-MM-DD.json.gz). Their images are packed into one
+zip per day (ARCHIVE_DIR/images/YYYY-MM-DD.zip) and the archived rows point to
+them as `archive/<day>/<filename>`, which /api/images resolves transparently.
+
+SQLite keeps only a small summary per archived day (cold_partitions and
+archived_detection_counts) so stats can be merged without reading the files.
+"""
+from datetime import datetime, date, timedelta
+from sqlalchemy import func, select
+from config import ARCHIVE_DIR, ARCHIVE_AFTER_DAYS, SERVER_IMAGES_DIR
+from database_setup import (Detection, Client, DetectionMetadata, ColdPartition, ArchivedDetectionCount,
+                            init_database, get_session, metadata_value_to_str)
+import gzip
+import json
+import os
+import sys
+import zipfile
+
+DETECTIONS_DIR = os.path.join(ARCHIVE_DIR, 'detections')
+IMAGES_DIR = os.path.join(ARCHIVE_DIR, 'images')
+IMAGE_PREFIX = 'archive/'
+
+COLUMNS = ['id', 'timestamp', 'class_name', 'confidence', 'image_path', 'bbox_x', 'bbox_y',
+           'bbox_width', 'bbox_height', 'metadata_json', 'client_id']
+
+
+def partition_path(day):
+    """Path of the detections file for a day"""
+    return os.path.join(DETECTIONS_DIR, f'{day.isoformat()}.json.gz')
+
+
+def image_pack_path(day):
+    """Path of the packed images file for a day"""
+    return os.path.join(IMAGES_DIR, f'{day.isoformat()}.zip')
+
+
+def read_partition(day):
+    """Read the archived detections of a day as a list of row dicts"""
+    path = partition_path(day)
+    if not os.path.exists(path):
+        return []
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        columns = json.load(f)['columns']
+    rows = [dict(zip(COLUMNS, values)) for values in zip(*(columns[name] for name in COLUMNS))]
+    for row in rows:
+        row['timestamp'] = datetime.fromisoformat(row['timestamp'])
+    return rows
+
+
+def write_partition(day, rows):
+    """Write the detections of a day, replacing any existing file"""
+    os.makedirs(DETECTIONS_DIR, exist_ok=True)
+    rows = sorted(rows, key=lambda row: (row['timestamp'], row['id']))
+    columns = {name: [row[name] for row in rows] for name in COLUMNS}
+    columns['timestamp'] = [ts.isoformat() for ts in columns['timestamp']]
+
+    path = partition_path(day)
+    tmp_path = path + '.tmp'
+    with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+        json.dump({'version': 1, 'columns': columns}, f, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+
+def same_detection(a, b):
+    """Whether two archived rows describe the same detection (image may have moved)"""
+    return (all(a[name] == b[name] for name in COLUMNS if name != 'image_path')
+            and os.path.basename(a['image_path']) == os.path.basename(b['image_path']))
+
+
+def pack_images(day, filenames):
+    """Add image files to the day's zip; returns the names now in the pack"""
+    os.makedirs(IMAGES_DIR, exist_ok=True)
+    packed = set()
+    # JPEGs are already compressed, so store them as-is
+    with zipfile.ZipFile(image_pack_path(day), 'a', compression=zipfile.ZIP_STORED) as pack:
+        existing = set(pack.namelist())
+        for filename in filenames:
+            if filename in existing:
+                packed.add(filename)
+                continue
+            image_path = os.path.join(SERVER_IMAGES_DIR, filename)
+            if os.path.exists(image_path):
+                pack.write(image_path, arcname=filename)
+                packed.add(filename)
+    return packed
+
+
+def read_archived_image(image_path):
+    """Return the bytes of an `archive/<day>/<filename>` image, or None"""
+    if not image_path.startswith(IMAGE_PREFIX):
+        return None
+    day_str, _, filename = image_path[len(IMAGE_PREFIX):].partition('/')
+    try:
+        day = date.fromisoformat(day_str)
+    except ValueError:
+        return None
+    path = image_pack_path(day)
+    if not filename or not os.path.exists(path):
+        return None
+    with zipfile.ZipFile(path) as pack:
+        try:
+            return pack.read(filename)
+        except KeyError:
+            return None
+
+
+def existing_client_ids(session, client_ids):
+    """The subset of client_ids that still exist"""
+    client_ids = [cid for cid in client_ids if cid is not None]
+    existing = set()
+    for i in range(0, len(client_ids), 500):
+        existing.update(cid for (cid,) in session.query(Client.id).filter(
+            Client.id.in_(client_ids[i:i + 500])))
+    return existing
+
+
+def images_in_use(session, filenames):
+    """The subset of filenames referenced by hot detections"""
+    in_use = set()
+    for i in range(0, len(filenames), 500):
+        in_use.update(path for (path,) in session.query(Detection.image_path).filter(
+            Detection.image_path.in_(filenames[i:i + 500])).distinct())
+    return in_use
+
+
+def archive_detections(engine, cutoff):
+    """Move detections with timestamp < cutoff to the cold archive, one day at a time.
+
+    Returns the number of detections archived.
+    """
+    session = get_session(engine)
+    days = sorted(date.fromisoformat(day) for (day,) in session.query(
+        func.date(Detection.timestamp)).filter(Detection.timestamp < cutoff).distinct())
+
+    total = 0
+    for day in days:
+        day_start = datetime.combine(day, datetime.min.time())
+        day_end = min(day_start + timedelta(days=1), cutoff)
+        day_detections = session.query(Detection).filter(
+            Detection.timestamp >= day_start, Detection.timestamp < day_end).all()
+        if not day_detections:
+            continue
+
+        # Every image of the day gets a copy in the day's pack, even one still
+        # used by a hot detection, so archived rows never point at a loose file
+        packed = pack_images(day, {det.image_path for det in day_detections
+                                   if not det.image_path.startswith(IMAGE_PREFIX)})
+
+        # Merge with an existing partition (a re-run after an interrupted archive
+        # sees the same rows again); a different detection with a known id is an error
+        new_rows = []
+        for det in day_detections:
+            image_path = det.image_path
+            if image_path in packed:
+                image_path = f'{IMAGE_PREFIX}{day.isoformat()}/{image_path}'
+            new_rows.append({
+                'id': det.id,
+                'timestamp': det.timestamp,
+                'class_name': det.class_name,
+                'confidence': det.confidence,
+                'image_path': image_path,
+                'bbox_x': det.bbox_x,
+                'bbox_y': det.bbox_y,
+                'bbox_width': det.bbox_width,
+                'bbox_height': det.bbox_height,
+                'metadata_json': det.metadata_json,
+                'client_id': det.client_id,
+            })
+        existing_rows = read_partition(day)
+        known_clients = existing_client_ids(session, {row['client_id'] for row in existing_rows})
+        archived = {}
+        for row in existing_rows:
+            # Deleted clients are dropped like the hot rows' client_id
+            if row['client_id'] not in known_clients:
+                row['client_id'] = None
+            archived[row['id']] = row
+        for row in new_rows:
+            existing = archived.get(row['id'])
+            if existing is not None and not same_detection(existing, row):
+                raise ValueError(
+                    f"Detection id {row['id']} is already archived for {day} as a different detection")
+            archived[row['id']] = row
+        rows = list(archived.values())
+        write_partition(day, rows)
+
+        # Rebuild the day's summary from the full partition
+        counts = {}
+        for row in rows:
+            group = (row['client_id'], row['class_name'])
+            counts[group] = counts.get(group, 0) + 1
+        session.query(ArchivedDetectionCount).filter(
+            ArchivedDetectionCount.day == day).delete(synchronize_session=False)
+        partition = session.get(ColdPartition, day) or ColdPartition(day=day)
+        partition.row_count = len(rows)
+        partition.min_id = min(row['id'] for row in rows)
+        partition.max_id = max(row['id'] for row in rows)
+        session.add(partition)
+        session.flush()
+        for (client_id, class_name), count in counts.items():
+            session.add(ArchivedDetectionCount(
+                day=day, client_id=client_id, class_name=class_name, count=count))
+
+        archived_ids = [det.id for det in day_detections]
+        for i in range(0, len(archived_ids), 500):
+            chunk = archived_ids[i:i + 500]
+            session.query(DetectionMetadata).filter(
+                DetectionMetadata.detection_id.in_(chunk)).delete(synchronize_session=False)
+            session.query(Detection).filter(
+                Detection.id.in_(chunk)).delete(synchronize_session=False)
+        session.commit()
+        session.expunge_all()
+        total += len(archived_ids)
+
+        # Only drop the originals once no detection left in the database points at them
+        for filename in packed - images_in_use(session, list(packed)):
+            image_path = os.path.join(SERVER_IMAGES_DIR, filename)
+            if os.path.exists(image_path):
+                os.remove(image_path)
+
+    session.close()
+    return total
+
+
+def cold_boundary(session):
+    """Datetime before which all archived detections lie, or None if the archive is empty"""
+    last_day = session.query(ColdPartition.day).order_by(ColdPartition.day.desc()).first()
+    if not last_day:
+        return None
+    return datetime.combine(last_day[0] + timedelta(days=1), datetime.min.time())
+
+
+def iter_cold_detections(session, start=None, end=None, class_name=None, client_ids=None,
+                         meta_filters=None):
+    """Yield archived detection rows, newest first, matching the given filters.
+
+    Rows whose client has since been deleted are yielded with client_id None.
+    """
+    if client_ids is not None:
+        client_ids = existing_client_ids(session, client_ids)
+    query = session.query(ColdPartition.day).order_by(ColdPartition.day.desc())
+    # Skip days the summary shows have nothing for this class/client
+    if class_name or client_ids is not None:
+        summary = select(ArchivedDetectionCount.day)
+        if class_name:
+            summary = summary.where(ArchivedDetectionCount.class_name == class_name)
+        if client_ids is not None:
+            summary = summary.where(ArchivedDetectionCount.client_id.in_(client_ids))
+        query = query.filter(ColdPartition.day.in_(summary))
+    if start:
+        query = query.filter(ColdPartition.day >= start.date())
+    if end:
+        query = query.filter(ColdPartition.day <= end.date())
+
+    for (day,) in query.all():
+        rows = read_partition(day)
+        rows.sort(key=lambda row: (row['timestamp'], row['id']), reverse=True)
+        known_clients = existing_client_ids(session, {row['client_id'] for row in rows})
+        for row in rows:
+            if row['client_id'] not in known_clients:
+                row['client_id'] = None
+            if start and row['timestamp'] < start:
+                continue
+            if end and row['timestamp'] > end:
+                continue
+            if class_name and row['class_name'] != class_name:
+                continue
+            if client_ids is not None and row['client_id'] not in client_ids:
+                continue
+            if meta_filters:
+                metadata = json.loads(row['metadata_json']) if row['metadata_json'] else {}
+                # Same rule as extract_indexed_metadata: only dict metadata is indexed
+                if not isinstance(metadata, dict) or any(key not in metadata or metadata[key] is None
+                       or metadata_value_to_str(metadata[key]) != value
+                       for key, value in meta_filters.items()):
+                    continue
+            yield row
+
+
+def get_cold_detection(session, detection_id):
+    """Find an archived detection row by id, or None"""
+    days = session.query(ColdPartition.day).filter(
+        ColdPartition.min_id <= detection_id, ColdPartition.max_id >= detection_id).all()
+    for (day,) in days:
+        for row in read_partition(day):
+            if row['id'] == detection_id:
+                return row
+    return None
+
+
+if __name__ == "__main__":
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else ARCHIVE_AFTER_DAYS
+    cutoff = datetime.combine(date.today() - timedelta(days=days), datetime.min.time())
+    print(f"Archiving detections older than {cutoff.isoformat()}...")
+    engine = init_database()
+    print(f"Archived {archive_detections(engine, cutoff)} detections to {ARCHIVE_DIR}")
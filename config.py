@@ -14,6 +14,15 @@ IMAGES_DIR = 'captured_images'  # Client images
 SERVER_IMAGES_DIR = os.path.join(os.path.dirname(__file__), 'captured_images')  # Server images
 MAX_IMAGES_PER_DETECTION = 5  # Maximum images to keep per detection class
 
+# Metadata keys copied out of metadata_json into the indexed detection_metadata
+# table on ingest, so /api/detections can filter on them (?meta.<key>=<value>)
+INDEXED_METADATA_FIELDS = ['model_version', 'frame_index', 'roi_hit']
+
+# Cold storage: detections older than ARCHIVE_AFTER_DAYS are moved out of the
+# database by `python archive.py` (daily compressed files + packed images)
+ARCHIVE_DIR = os.path.join(os.path.dirname(__file__), 'archive')
+ARCHIVE_AFTER_DAYS = 30
+
 # Detection Configuration
 DETECTION_THRESHOLD = 0.35
 IOU_THRESHOLD = 0.45
@@ -1,14 +1,19 @@
 from datetime import datetime
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, Text, Boolean, ForeignKey
+from sqlalchemy import create_engine, func, select, Column, Integer, String, Float, Date, DateTime, Text, Boolean, ForeignKey, Index
 from sqlalchemy.orm import declarative_base, relationship
 from sqlalchemy.orm import sessionmaker
-from config import DATABASE_URL, SERVER_IMAGES_DIR
+from sqlalchemy.schema import CreateTable
+from config import DATABASE_URL, SERVER_IMAGES_DIR, INDEXED_METADATA_FIELDS
+import json
 import os
+import sys
 
 Base = declarative_base()
 
 class Client(Base):
     __tablename__ = 'clients'
+    # Ids must never be reused: archived detections keep their client_id
+    __table_args__ = {'sqlite_autoincrement': True}
 
     id = Column(Integer, primary_key=True)
     name = Column(String(100), nullable=False, unique=True)
@@ -28,6 +33,8 @@ class Client(Base):
 
 class Detection(Base):
     __tablename__ = 'detections'
+    # Ids must never be reused: archived detections keep theirs (see archive.py)
+    __table_args__ = {'sqlite_autoincrement': True}
 
     id = Column(Integer, primary_key=True)
     timestamp = Column(DateTime, nullable=False)
@@ -43,6 +50,61 @@ class Detection(Base):
 
     # Relationship to client
     client = relationship("Client", back_populates="detections")
+    # Indexed copies of selected metadata keys
+    metadata_fields = relationship(
+        "DetectionMetadata", back_populates="detection", cascade="all, delete-orphan")
+
+class DetectionMetadata(Base):
+    """One indexed metadata key/value of a detection (see INDEXED_METADATA_FIELDS)"""
+    __tablename__ = 'detection_metadata'
+    __table_args__ = (
+        Index('ix_detection_metadata_key_value', 'key', 'value'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    detection_id = Column(Integer, ForeignKey('detections.id'), nullable=False, index=True)
+    key = Column(String(50), nullable=False)
+    value = Column(String(255), nullable=True)
+
+    detection = relationship("Detection", back_populates="metadata_fields")
+
+class ColdPartition(Base):
+    """One day of detections moved to the cold archive (see archive.py)"""
+    __tablename__ = 'cold_partitions'
+
+    day = Column(Date, primary_key=True)
+    row_count = Column(Integer, nullable=False, default=0)
+    min_id = Column(Integer, nullable=True)
+    max_id = Column(Integer, nullable=True)
+    archived_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class ArchivedDetectionCount(Base):
+    """Per day/client/class detection counts of the cold archive, used by stats"""
+    __tablename__ = 'archived_detection_counts'
+
+    id = Column(Integer, primary_key=True)
+    day = Column(Date, ForeignKey('cold_partitions.day'), nullable=False, index=True)
+    client_id = Column(Integer, nullable=True, index=True)
+    class_name = Column(String(50), nullable=False)
+    count = Column(Integer, nullable=False, default=0)
+
+def metadata_value_to_str(value):
+    """Normalize a metadata value to the string stored in the index"""
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, sort_keys=True)
+    return str(value)
+
+def extract_indexed_metadata(metadata):
+    """Build DetectionMetadata rows for the indexed keys present in metadata"""
+    if not isinstance(metadata, dict):
+        return []
+    return [
+        DetectionMetadata(key=key, value=metadata_value_to_str(metadata[key]))
+        for key in INDEXED_METADATA_FIELDS
+        if key in metadata and metadata[key] is not None
+    ]
 
 def init_database():
     """Initialize the database and create tables"""
@@ -50,18 +112,91 @@ def init_database():
 
     # Create tables
     Base.metadata.create_all(engine)
+    migrate_ids(engine)
 
     # Create images directory
     os.makedirs(SERVER_IMAGES_DIR, exist_ok=True)
 
     return engine
 
+def ensure_autoincrement(conn, engine, table, highest_id):
+    """Rebuild a table with AUTOINCREMENT if needed and keep its sequence above highest_id"""
+    name = table.name
+    table_sql = conn.exec_driver_sql(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).scalar()
+    if 'AUTOINCREMENT' not in table_sql.upper():
+        create_sql = str(CreateTable(table).compile(engine)).replace(
+            f'CREATE TABLE {name} ', f'CREATE TABLE {name}_new ', 1)
+        columns = ', '.join(column.name for column in table.columns)
+        conn.exec_driver_sql(create_sql)
+        conn.exec_driver_sql(
+            f"INSERT INTO {name}_new ({columns}) SELECT {columns} FROM {name}")
+        conn.exec_driver_sql(f"DROP TABLE {name}")
+        conn.exec_driver_sql(f"ALTER TABLE {name}_new RENAME TO {name}")
+
+    if highest_id:
+        seq = conn.exec_driver_sql(
+            "SELECT seq FROM sqlite_sequence WHERE name = ?", (name,)).scalar()
+        if seq is None:
+            conn.exec_driver_sql(
+                "INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (name, highest_id))
+        elif seq < highest_id:
+            conn.exec_driver_sql(
+                "UPDATE sqlite_sequence SET seq = ? WHERE name = ?", (highest_id, name))
+
+def migrate_ids(engine):
+    """Make sure detection and client ids are never handed out twice.
+
+    Archived detections keep their own id and their client's id, so databases
+    created before sqlite_autoincrement get both tables rebuilt with
+    AUTOINCREMENT, and each sequence is raised above every id still referenced.
+    """
+    if engine.dialect.name != 'sqlite':
+        return
+    with engine.begin() as conn:
+        highest_detection_id = max(
+            conn.execute(select(func.max(Detection.id))).scalar() or 0,
+            conn.execute(select(func.max(ColdPartition.max_id))).scalar() or 0)
+        ensure_autoincrement(conn, engine, Detection.__table__, highest_detection_id)
+
+        highest_client_id = max(
+            conn.execute(select(func.max(Client.id))).scalar() or 0,
+            conn.execute(select(func.max(Detection.client_id))).scalar() or 0,
+            conn.execute(select(func.max(ArchivedDetectionCount.client_id))).scalar() or 0)
+        ensure_autoincrement(conn, engine, Client.__table__, highest_client_id)
+
 def get_session(engine):
     """Get a database session"""
     Session = sessionmaker(bind=engine)
     return Session()
 
+def backfill_indexed_metadata(engine):
+    """Rebuild detection_metadata from metadata_json for all detections.
+
+    Run after changing INDEXED_METADATA_FIELDS so older rows become filterable.
+    """
+    session = get_session(engine)
+    session.query(DetectionMetadata).delete()
+    count = 0
+    detections = session.query(Detection.id, Detection.metadata_json).yield_per(1000)
+    with session.no_autoflush:
+        for detection_id, metadata_json in detections:
+            try:
+                metadata = json.loads(metadata_json) if metadata_json else {}
+            except ValueError:
+                continue
+            rows = extract_indexed_metadata(metadata)
+            for row in rows:
+                row.detection_id = detection_id
+            session.add_all(rows)
+            count += len(rows)
+    session.commit()
+    session.close()
+    return count
+
 if __name__ == "__main__":
     print("Initializing database...")
     engine = init_database()
     print("Database initialized successfully!")
+    if "--backfill-metadata" in sys.argv:
+        print(f"Indexed {backfill_indexed_metadata(engine)} metadata values")
@@ -1,8 +1,11 @@
 import config as config
-from database_setup import Detection, Client, init_database, get_session
-from sqlalchemy.orm import sessionmaker, joinedload
+from database_setup import Detection, Client, DetectionMetadata, ArchivedDetectionCount, init_database, get_session, extract_indexed_metadata
+from archive import cold_boundary, iter_cold_detections, get_cold_detection, read_archived_image
+from sqlalchemy.orm import sessionmaker, joinedload, aliased
 from sqlalchemy import func
-from datetime import datetime
+from datetime import datetime, timedelta
+from itertools import islice
+import io
 import json
 import os
 from flask_cors import CORS
@@ -99,6 +102,8 @@ def receive_detection():
         ws = data["bbox_width"]
         hs = data["bbox_height"]
 
+        metadata = data.get('metadata', {})
+
         # Create detection record
         session = Session()
         for i in range(len(class_names)):
@@ -111,8 +116,9 @@ def receive_detection():
                 bbox_y=int(ys[i]),
                 bbox_width=int(ws[i]),
                 bbox_height=int(hs[i]),
-                metadata_json=json.dumps(data.get('metadata', {})),
-                client_id=client_id
+                metadata_json=json.dumps(metadata),
+                client_id=client_id,
+                metadata_fields=extract_indexed_metadata(metadata)
             )
 
             session.add(detection)
@@ -126,6 +132,70 @@ def receive_detection():
         return jsonify({'error': str(e)}), 500
 
 
+def client_to_dict(client):
+    """Client summary embedded in detection responses"""
+    return {
+        'id': client.id,
+        'name': client.name,
+        'latitude': client.latitude,
+        'longitude': client.longitude,
+        'is_detect_enabled': client.is_detect_enabled
+    }
+
+
+def detection_to_dict(det):
+    """Convert a Detection (hot) to its JSON response"""
+    detection_data = {
+        'id': det.id,
+        'timestamp': det.timestamp.isoformat(),
+        'class_name': det.class_name,
+        'confidence': det.confidence,
+        'image_path': det.image_path,
+        'bbox_x': det.bbox_x,
+        'bbox_y': det.bbox_y,
+        'bbox_width': det.bbox_width,
+        'bbox_height': det.bbox_height,
+        'metadata': json.loads(det.metadata_json) if det.metadata_json else {}
+    }
+
+    # Add client information if available
+    if det.client:
+        detection_data['client'] = client_to_dict(det.client)
+
+    return detection_data
+
+
+def cold_detection_to_dict(row, client):
+    """Convert an archived detection row to the same JSON response"""
+    detection_data = {
+        'id': row['id'],
+        'timestamp': row['timestamp'].isoformat(),
+        'class_name': row['class_name'],
+        'confidence': row['confidence'],
+        'image_path': row['image_path'],
+        'bbox_x': row['bbox_x'],
+        'bbox_y': row['bbox_y'],
+        'bbox_width': row['bbox_width'],
+        'bbox_height': row['bbox_height'],
+        'metadata': json.loads(row['metadata_json']) if row['metadata_json'] else {}
+    }
+
+    if client:
+        detection_data['client'] = client_to_dict(client)
+
+    return detection_data
+
+
+def parse_time_arg(value):
+    """Parse an ISO start/end query parameter to naive local time (timestamps are stored naive)"""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed
+
+
 @app.route('/api/detections', methods=['GET'])
 def get_detections():
     """Get all detections with optional filtering"""
@@ -136,11 +206,32 @@ def get_detections():
         class_name = request.args.get('class')
         client_id = request.args.get('client_id')
         client_name = request.args.get('client_name')
+        try:
+            start = parse_time_arg(request.args.get('start'))
+            end = parse_time_arg(request.args.get('end'))
+        except ValueError as e:
+            session.close()
+            return jsonify({'error': f'Invalid start/end: {e}'}), 400
         limit = int(request.args.get('limit', 100))
         offset = int(request.args.get('offset', 0))
 
+        # Metadata filters: ?meta.<key>=<value>, only for indexed keys
+        meta_filters = {}
+        for arg, value in request.args.items():
+            if arg.startswith('meta.'):
+                key = arg[len('meta.'):]
+                if key not in config.INDEXED_METADATA_FIELDS:
+                    session.close()
+                    return jsonify({'error': f'Metadata field is not indexed: {key}'}), 400
+                meta_filters[key] = value
+
         query = session.query(Detection)
 
+        for key, value in meta_filters.items():
+            meta = aliased(DetectionMetadata)
+            query = query.join(meta, meta.detection_id == Detection.id).filter(
+                meta.key == key, meta.value == value)
+
         if class_name:
             query = query.filter(Detection.class_name == class_name)
 
@@ -151,40 +242,51 @@ def get_detections():
             # Join with Client table to filter by client name
             query = query.join(Client).filter(Client.name == client_name)
 
-        # Order by timestamp (most recent first)
-        detections = query.options(joinedload(Detection.client)).order_by(
-            Detection.timestamp.desc()).offset(offset).limit(limit).all()
-        session.close()
+        if start:
+            query = query.filter(Detection.timestamp >= start)
 
-        # Convert to JSON-serializable format
-        result = []
-        for det in detections:
-            detection_data = {
-                'id': det.id,
-                'timestamp': det.timestamp.isoformat(),
-                'class_name': det.class_name,
-                'confidence': det.confidence,
-                'image_path': det.image_path,
-                'bbox_x': det.bbox_x,
-                'bbox_y': det.bbox_y,
-                'bbox_width': det.bbox_width,
-                'bbox_height': det.bbox_height,
-                'metadata': json.loads(det.metadata_json) if det.metadata_json else {}
-            }
+        if end:
+            query = query.filter(Detection.timestamp <= end)
 
-            # Add client information if available
-            if det.client:
-                detection_data['client'] = {
-                    'id': det.client.id,
-                    'name': det.client.name,
-                    'latitude': det.client.latitude,
-                    'longitude': det.client.longitude,
-                    'is_detect_enabled': det.client.is_detect_enabled
-                }
+        # Order by timestamp (most recent first)
+        query = query.options(joinedload(Detection.client)).order_by(
+            Detection.timestamp.desc())
+
+        # Only go to the cold archive when the range reaches before its boundary
+        boundary = cold_boundary(session)
+        needed = offset + limit
+        if not boundary or (start and start >= boundary) or needed <= 0:
+            detections = query.offset(offset).limit(limit).all()
+            session.close()
+            return jsonify([detection_to_dict(det) for det in detections])
 
-            result.append(detection_data)
+        detections = query.limit(needed).all()
+        merged = [(det.timestamp, det.id, detection_to_dict(det)) for det in detections]
 
-        return jsonify(result)
+        # A full page of hot rows newer than the boundary can't be displaced by cold rows
+        if len(detections) < needed or detections[-1].timestamp < boundary:
+            client_ids = None
+            if client_name:
+                client_ids = {cid for (cid,) in session.query(
+                    Client.id).filter(Client.name == client_name)}
+            if client_id:
+                client_ids = {int(client_id)} if client_ids is None else client_ids & {int(client_id)}
+
+            # A day being re-archived is briefly both hot and cold; the hot row wins
+            hot_ids = {det.id for det in detections}
+            cold_rows = list(islice((row for row in iter_cold_detections(
+                session, start=start, end=end, class_name=class_name,
+                client_ids=client_ids, meta_filters=meta_filters)
+                if row['id'] not in hot_ids), needed))
+            cold_client_ids = {row['client_id'] for row in cold_rows if row['client_id']}
+            clients = {client.id: client for client in session.query(Client).filter(
+                Client.id.in_(cold_client_ids))} if cold_client_ids else {}
+            merged.extend((row['timestamp'], row['id'], cold_detection_to_dict(
+                row, clients.get(row['client_id']))) for row in cold_rows)
+        session.close()
+
+        merged.sort(key=lambda item: (item[0], item[1]), reverse=True)
+        return jsonify([item[2] for item in merged[offset:needed]])
 
     except Exception as e:
         print(e)
@@ -220,18 +322,41 @@ def get_detection_stats():
         for (class_name,) in results:
             class_counts[class_name] = class_counts.get(class_name, 0) + 1
 
+        # Add archived detections from the per-day summary
+        archived_query = session.query(
+            ArchivedDetectionCount.class_name, func.sum(ArchivedDetectionCount.count))
+        client_ids = None
+        if client_id:
+            client_ids = {int(client_id)}
+        elif client_name:
+            client_ids = {cid for (cid,) in session.query(
+                Client.id).filter(Client.name == client_name)}
+        if client_ids is not None:
+            archived_query = archived_query.filter(
+                ArchivedDetectionCount.client_id.in_(client_ids))
+        for class_name, count in archived_query.group_by(ArchivedDetectionCount.class_name):
+            total_detections += count
+            class_counts[class_name] = class_counts.get(class_name, 0) + count
+
         # Get recent detections (last 24 hours)
-        from datetime import timedelta
         yesterday = datetime.now() - timedelta(days=1)
         recent_detections = base_query.filter(
             Detection.timestamp >= yesterday).count()
+        boundary = cold_boundary(session)
+        if boundary and boundary > yesterday:
+            recent_detections += sum(1 for _ in iter_cold_detections(
+                session, start=yesterday, client_ids=client_ids))
 
         # Get client statistics
+        archived_by_client = dict(session.query(
+            ArchivedDetectionCount.client_id, func.sum(ArchivedDetectionCount.count)).group_by(
+            ArchivedDetectionCount.client_id).all())
         client_stats = {}
         client_results = session.query(Client).all()
         for client in client_results:
             client_detections = session.query(Detection).filter(
                 Detection.client_id == client.id).count()
+            client_detections += archived_by_client.get(client.id, 0)
             client_stats[client.name] = {
                 'id': client.id,
                 'detections': client_detections,
@@ -265,8 +390,12 @@ def get_image(filename):
         image_path = os.path.join(config.SERVER_IMAGES_DIR, filename)
         if os.path.exists(image_path):
             return send_file(image_path, mimetype='image/jpeg')
-        else:
-            return jsonify({'error': 'Image not found'}), 404
+
+        # Images of archived detections live in the packed archive store
+        image_data = read_archived_image(filename)
+        if image_data is not None:
+            return send_file(io.BytesIO(image_data), mimetype='image/jpeg')
+        return jsonify({'error': 'Image not found'}), 404
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -278,33 +407,20 @@ def get_detection(detection_id):
         session = Session()
         detection = session.query(Detection).options(joinedload(
             Detection.client)).filter(Detection.id == detection_id).first()
-        session.close()
 
         if detection:
-            result = {
-                'id': detection.id,
-                'timestamp': detection.timestamp.isoformat(),
-                'class_name': detection.class_name,
-                'confidence': detection.confidence,
-                'image_path': detection.image_path,
-                'bbox_x': detection.bbox_x,
-                'bbox_y': detection.bbox_y,
-                'bbox_width': detection.bbox_width,
-                'bbox_height': detection.bbox_height,
-                'metadata': json.loads(detection.metadata_json) if detection.metadata_json else {}
-            }
+            session.close()
+            return jsonify(detection_to_dict(detection))
+
+        # Fall back to the cold archive
+        row = get_cold_detection(session, detection_id)
+        client = None
+        if row and row['client_id']:
+            client = session.query(Client).filter(Client.id == row['client_id']).first()
+        session.close()
 
-            # Add client information if available
-            if detection.client:
-                result['client'] = {
-                    'id': detection.client.id,
-                    'name': detection.client.name,
-                    'latitude': detection.client.latitude,
-                    'longitude': detection.client.longitude,
-                    'is_detect_enabled': detection.client.is_detect_enabled
-                }
-
-            return jsonify(result)
+        if row:
+            return jsonify(cold_detection_to_dict(row, client))
         else:
             return jsonify({'error': 'Detection not found'}), 404
 
@@ -326,9 +442,14 @@ def get_clients():
             .group_by(Client.id)
             .all()
         )
+        archived_by_client = dict(session.query(
+            ArchivedDetectionCount.client_id, func.sum(ArchivedDetectionCount.count)).group_by(
+            ArchivedDetectionCount.client_id).all())
+        session.close()
 
         result = []
         for client, count in clients_with_count:
+            count += archived_by_client.get(client.id, 0)
             result.append({
                 'id': client.id,
                 'name': client.name,
@@ -425,10 +546,18 @@ def get_frame(client_id):
         session = Session()
         detection = session.query(Detection).filter(
             Detection.client_id == client_id).order_by(Detection.timestamp.desc()).first()
+        if detection:
+            image_path = detection.image_path
+        else:
+            # All of this client's detections may already be archived
+            row = next(iter_cold_detections(session, client_ids={client_id}), None)
+            image_path = row['image_path'] if row else None
 
         session.close()
+        if image_path is None:
+            return jsonify({'error': 'No frame found for this client'}), 404
         result = {
-            "image": detection.image_path
+            "image": image_path
         }
         return jsonify(result), 200 
             
@@ -527,6 +656,11 @@ def delete_client(client_id):
             session.close()
             return jsonify({'error': 'Client not found'}), 404
 
+        # Hot detections lose their client via the relationship; do the same
+        # for the archive summary (archived rows are resolved against clients)
+        session.query(ArchivedDetectionCount).filter(
+            ArchivedDetectionCount.client_id == client_id).update(
+            {ArchivedDetectionCount.client_id: None}, synchronize_session=False)
         session.delete(client)
         session.commit()
         session.close()